@@ -1,74 +1,681 @@
 import os
 import io
-from flask import Flask, request, jsonify, send_from_directory
+import asyncio
+import dataclasses
+import hashlib
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import orjson
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+from cachetools import LRUCache
+from flask import Flask, request, jsonify, send_from_directory, g, abort, Response
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS # Needed for cross-origin requests from frontend
+from flask_compress import Compress
 from dotenv import load_dotenv
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from pydantic import BaseModel, TypeAdapter
 from pydub import AudioSegment # For audio processing utilities if needed
+from mutagen import MutagenError
+from mutagen.mp3 import MP3
+from redis import BlockingConnectionPool, Redis
+from redis.exceptions import RedisError
+from rq import Queue
+from rq.exceptions import NoSuchJobError
+from rq.job import Job, JobStatus
 
 # Load environment variables from .env file
 load_dotenv()
 
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider that encodes responses and decodes request bodies with orjson instead of the stdlib json module."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 # Allow CORS for all origins, necessary for local frontend development
 # In a production environment, you would restrict this to your frontend's domain.
 CORS(app)
 
+# Reject request bodies over 200 MB before they are read. This leaves headroom over a
+# 15 minute uncompressed WAV (44.1 kHz, 16-bit stereo is about 150 MB).
+app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024
+
+# Compress JSON/text responses (brotli or gzip, whichever the client accepts).
+# Generated notes are multi-KB markdown that shrinks well; tiny responses aren't worth the CPU.
+app.config['COMPRESS_MIMETYPES'] = ['application/json', 'text/plain']
+app.config['COMPRESS_LEVEL'] = 4 # gzip
+app.config['COMPRESS_BR_LEVEL'] = 4
+app.config['COMPRESS_MIN_SIZE'] = 512
+Compress(app)
+
 # Configure Gemini API
 # This will raise an error if GEMINI_API_KEY is not set
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
-# Define a function to initialize the Gemini model
-def get_gemini_model():
-    """Initializes and returns the Gemini Pro Vision (gemini-2.0-flash) model for multimodal input."""
-    return genai.GenerativeModel('gemini-2.0-flash')
+# Background generation jobs are queued in Redis and run by a separate RQ worker
+# process (see tasks.py), so long Gemini calls don't hold up the web workers.
+# Redis also shares the response and Gemini file caches between all of these processes.
+# The blocking pool makes threads wait for a free connection instead of erroring at the limit.
+redis_connection = Redis(connection_pool=BlockingConnectionPool.from_url(
+    os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+    max_connections=32,
+))
+generation_queue = Queue("generation", connection=redis_connection)
+
+# The Gemini (gemini-2.0-flash) model for multimodal input, created once and shared by all requests
+MODEL = genai.GenerativeModel('gemini-2.0-flash')
+
+# Uploads are copied and hashed in fixed-size chunks so memory use stays bounded
+# regardless of file size. Spooled uploads larger than SPOOL_MAX_SIZE spill to disk.
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+# MIME type sent to Gemini for each supported file extension
+MIME_MAP = {'mp3': 'audio/mpeg', 'wav': 'audio/wav'}
+ALLOWED_EXTENSIONS = frozenset(MIME_MAP)
+
+# --- Response Cache ---
+# Students usually click all three buttons for the same lecture, re-uploading the
+# same audio each time. Gemini responses are cached per (prompt, audio content)
+# so repeat requests skip the model round-trip entirely.
+# Each process keeps recent responses in memory, backed by Redis so that every
+# gunicorn worker and the RQ worker see each other's responses.
+RESPONSE_CACHE_TTL = timedelta(days=7)
+
+_response_cache = LRUCache(maxsize=64)
+_response_cache_lock = threading.Lock()
+
+# Gemini calls currently in flight, keyed like the cache and guarded by the same lock.
+# Concurrent requests for the same prompt and audio (e.g. a double click, or /generate_all
+# racing a single endpoint) wait for the first call's result instead of calling Gemini again.
+_pending_responses = {}
+
+def get_cached_response(prompt_key, audio_hash):
+    """Returns the cached response text for this prompt and audio, from this process or Redis, or None."""
+    with _response_cache_lock:
+        cached_text = _response_cache.get((prompt_key, audio_hash))
+    if cached_text is not None:
+        return cached_text
 
-# --- Helper Functions ---
+    try:
+        cached_text = redis_connection.get(f"gemini:response:{prompt_key}:{audio_hash}")
+    except RedisError:
+        return None # The cache is an optimisation; carry on without Redis
+    if cached_text is None:
+        return None
+
+    cached_text = cached_text.decode()
+    with _response_cache_lock:
+        _response_cache[(prompt_key, audio_hash)] = cached_text
+    return cached_text
+
+def cache_response(prompt_key, audio_hash, text):
+    """Stores the response text for this prompt and audio, in this process and in Redis."""
+    with _response_cache_lock:
+        _response_cache[(prompt_key, audio_hash)] = text
+    try:
+        redis_connection.setex(f"gemini:response:{prompt_key}:{audio_hash}", RESPONSE_CACHE_TTL, text)
+    except RedisError:
+        pass
+
+# --- Gemini File Cache ---
+# Audio is uploaded to the Gemini File API once per content hash and then passed
+# to every prompt by reference, instead of re-sending the audio bytes each time.
+# Gemini deletes uploaded files after 48 hours, so files close to expiry are re-uploaded.
+# The hash -> file name mapping is also kept in Redis (expiring with the file), so a
+# file uploaded by one worker process is reused by the others. Files are not deleted
+# when evicted from a process's cache, since other processes may still be using them.
+FILE_EXPIRY_MARGIN = timedelta(hours=1)
+FILE_PROCESSING_TIMEOUT = 60 # Seconds to wait for an upload to leave the PROCESSING state
+
+_uploaded_files = LRUCache(maxsize=64)
+_uploaded_files_lock = threading.Lock()
+
+def get_shared_gemini_file(audio_hash):
+    """Returns the Gemini File another process uploaded for this audio hash, if it still exists."""
+    try:
+        file_name = redis_connection.get(f"gemini:file:{audio_hash}")
+    except RedisError:
+        return None
+    if file_name is None:
+        return None
 
-def validate_audio_file(file_stream, filename):
+    try:
+        uploaded_file = genai.get_file(file_name.decode())
+    except google_exceptions.GoogleAPIError:
+        return None # Deleted or already expired on Gemini's side
+    return uploaded_file if uploaded_file.state.name == "ACTIVE" else None
+
+def get_gemini_file(audio_file_obj, mime_type, audio_hash):
     """
-    Validates audio file type and duration.
-    Returns (True, None) if valid, or (False, error_message) if invalid.
+    Returns the Gemini File for this audio, uploading it on first sight of its hash
+    or when the previously uploaded copy is about to expire.
     """
-    if not filename:
-        return False, "No file uploaded."
+    with _uploaded_files_lock:
+        uploaded_file = _uploaded_files.get(audio_hash)
+    if uploaded_file is None:
+        uploaded_file = get_shared_gemini_file(audio_hash)
+    if uploaded_file is not None and uploaded_file.expiration_time - datetime.now(timezone.utc) > FILE_EXPIRY_MARGIN:
+        with _uploaded_files_lock:
+            _uploaded_files[audio_hash] = uploaded_file
+        return uploaded_file
+
+    audio_file_obj.seek(0)
+    # upload_file only accepts the spool as a file object on Python 3.11+, where
+    # SpooledTemporaryFile is an io.IOBase; earlier versions treat it as a path
+    uploaded_file = genai.upload_file(audio_file_obj, mime_type=mime_type)
+    # Audio is usually ready straight away, but wait in case Gemini is still processing it
+    deadline = time.monotonic() + FILE_PROCESSING_TIMEOUT
+    while uploaded_file.state.name == "PROCESSING":
+        if time.monotonic() >= deadline:
+            raise TimeoutError(
+                f"Gemini is still processing the uploaded audio file ({uploaded_file.name}) "
+                f"after {FILE_PROCESSING_TIMEOUT} seconds."
+            )
+        time.sleep(1)
+        uploaded_file = genai.get_file(uploaded_file.name)
+    if uploaded_file.state.name == "FAILED":
+        raise RuntimeError(f"Gemini could not process the uploaded audio file ({uploaded_file.name}).")
+
+    with _uploaded_files_lock:
+        _uploaded_files[audio_hash] = uploaded_file
+    # Share the file until shortly before Gemini deletes it (about 47 hours)
+    shared_ttl = uploaded_file.expiration_time - datetime.now(timezone.utc) - FILE_EXPIRY_MARGIN
+    if shared_ttl > timedelta(0):
+        try:
+            redis_connection.setex(f"gemini:file:{audio_hash}", shared_ttl, uploaded_file.name)
+        except RedisError:
+            pass
+    return uploaded_file
 
-    # Validate file extension
-    ext = filename.rsplit('.', 1)[1].lower()
-    if ext not in ['mp3', 'wav']:
-        return False, f"Unsupported file type: .{ext}. Only MP3 and WAV are allowed."
+# --- Helper Functions ---
 
+def get_wav_duration_seconds(file_stream):
+    """
+    Reads the duration of a WAV file from its RIFF chunk headers, without decoding any audio.
+    Raises ValueError if the headers are missing or malformed.
+    """
+    riff_id, _, wave_id = struct.unpack('<4sI4s', file_stream.read(12))
+    if riff_id != b'RIFF' or wave_id != b'WAVE':
+        raise ValueError("Not a RIFF/WAVE file.")
+
+    byte_rate = None
+    while True:
+        chunk_header = file_stream.read(8)
+        if len(chunk_header) < 8:
+            raise ValueError("WAV file has no data chunk.")
+        chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+        padded_size = chunk_size + (chunk_size & 1) # Chunks are word-aligned
+
+        if chunk_id == b'fmt ':
+            fmt_chunk = file_stream.read(padded_size)
+            byte_rate = struct.unpack('<I', fmt_chunk[8:12])[0]
+        elif chunk_id == b'data':
+            # Streamed WAVs leave the data size unset (0 or 0xFFFFFFFF)
+            if not byte_rate or chunk_size in (0, 0xFFFFFFFF):
+                raise ValueError("WAV headers do not describe the data length.")
+            return chunk_size / byte_rate
+        else:
+            file_stream.seek(padded_size, io.SEEK_CUR)
+
+def get_audio_duration_seconds(file_stream, ext):
+    """
+    Returns the audio duration in seconds, read from the file headers where possible.
+    Falls back to decoding the audio with pydub for files whose headers can't be parsed.
+    """
+    file_stream.seek(0)
     try:
-        # Use pydub to load audio and check duration
-        # Rewind the stream before passing to AudioSegment
+        if ext == 'wav':
+            return get_wav_duration_seconds(file_stream)
+        return MP3(file_stream).info.length
+    except (struct.error, ValueError, MutagenError):
         file_stream.seek(0)
         audio = AudioSegment.from_file(file_stream, format=ext)
-        duration_minutes = len(audio) / (1000 * 60) # duration in milliseconds
+        return len(audio) / 1000 # duration in milliseconds
+    finally:
+        file_stream.seek(0)
+
+def prompt_cache_key(name, prompt_text, generation_config=None):
+    """
+    Returns the response cache key for a prompt: its name plus a short hash of the prompt
+    text and generation config (including the response schema). Editing a prompt or schema
+    changes the key, so responses cached (e.g. in Redis) for the old version are not reused.
+    """
+    fingerprint = hashlib.sha256(prompt_text.encode())
+    if generation_config is not None:
+        # The schema's repr is just the class name, so hash its JSON schema instead
+        response_schema = TypeAdapter(generation_config.response_schema).json_schema()
+        fingerprint.update(repr(dataclasses.replace(generation_config, response_schema=None)).encode())
+        fingerprint.update(orjson.dumps(response_schema, option=orjson.OPT_SORT_KEYS))
+    return f"{name}:{fingerprint.hexdigest()[:12]}"
+
+def get_file_extension(filename):
+    """Returns the lowercased extension of a filename (without the dot), or '' if it has none."""
+    _, dot, ext = filename.rpartition('.')
+    return ext.lower() if dot else ''
+
+def validate_audio_file(file_stream, ext):
+    """
+    Validates audio file type (from its extension) and duration.
+    Returns (True, None) if valid, or (False, error_message) if invalid.
+    """
+    # Validate file extension
+    if ext not in ALLOWED_EXTENSIONS:
+        file_type = f".{ext}" if ext else "no extension"
+        return False, f"Unsupported file type: {file_type}. Only MP3 and WAV are allowed."
+
+    try:
+        # Read the duration from the file headers; the stream is rewound afterwards
+        duration_minutes = get_audio_duration_seconds(file_stream, ext) / 60
 
         if duration_minutes > 15:
             return False, f"Audio file is too long ({duration_minutes:.2f} mins). Maximum allowed is 15 minutes."
 
-        # Rewind the stream again so it can be read by Gemini API later
-        file_stream.seek(0)
         return True, None
     except Exception as e:
         return False, f"Could not process audio file: {str(e)}"
 
-# --- API Endpoints ---
+def spool_upload(file_stream):
+    """
+    Copies an uploaded file stream into a spooled temporary file in chunks.
+    Returns the spool, rewound and ready to be read.
+    """
+    file_stream.seek(0)
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    shutil.copyfileobj(file_stream, spool, length=UPLOAD_CHUNK_SIZE)
+    spool.seek(0)
+    return spool
+
+def hash_file_chunked(file_obj):
+    """Returns the SHA-256 hex digest of a file object, reading it in chunks, then rewinds it."""
+    hasher = hashlib.sha256()
+    while chunk := file_obj.read(UPLOAD_CHUNK_SIZE):
+        hasher.update(chunk)
+    file_obj.seek(0)
+    return hasher.hexdigest()
+
+def get_audio_part(audio_file_obj, mime_type, audio_hash):
+    """
+    Returns the Gemini content part for an upload. Audio small enough to stay in the
+    in-memory spool is sent inline; anything larger has already spilled to disk and is
+    streamed to the Gemini File API from there instead of being read into memory.
+    """
+    audio_size = audio_file_obj.seek(0, io.SEEK_END)
+    if audio_size > SPOOL_MAX_SIZE:
+        return get_gemini_file(audio_file_obj, mime_type, audio_hash)
+
+    audio_file_obj.seek(0)
+    return {
+        "mime_type": mime_type,
+        "data": audio_file_obj.read()
+    }
+
+def make_audio_part_loader(audio_file_obj, mime_type, audio_hash):
+    """
+    Returns a function that builds the Gemini audio part for an upload on its first call.
+    The audio is read or uploaded at most once, and the loader is safe to share between threads.
+    If that fails, later calls re-raise the same error instead of trying again.
+    """
+    lock = threading.Lock()
+    audio_part = []
+    error = []
+
+    def load_audio_part():
+        with lock:
+            if error:
+                raise error[0]
+            if not audio_part:
+                try:
+                    audio_part.append(get_audio_part(audio_file_obj, mime_type, audio_hash))
+                except Exception as e:
+                    error.append(e)
+                    raise
+        return audio_part[0]
+
+    return load_audio_part
+
+# Finish reasons for which a response counts as complete. MAX_TOKENS is accepted, since
+# the text is still usable; one cut short by e.g. SAFETY or RECITATION is not.
+COMPLETE_FINISH_REASONS = (
+    genai.protos.Candidate.FinishReason.STOP,
+    genai.protos.Candidate.FinishReason.MAX_TOKENS,
+)
+
+def check_response_complete(finish_reason, response_text):
+    """
+    Raises RuntimeError if Gemini stopped before the response was complete or returned no text.
+    Both the streaming and non-streaming paths call this before caching a response.
+    """
+    if finish_reason not in COMPLETE_FINISH_REASONS:
+        reason_name = finish_reason.name if finish_reason is not None else "no finish reason"
+        raise RuntimeError(f"Gemini stopped generating before the response was complete ({reason_name}).")
+    if not response_text:
+        raise RuntimeError("Gemini returned an empty response.")
+
+def generate_cached(prompt_key, prompt_text, load_audio_part, audio_hash, generation_config=None, parse_response=None):
+    """
+    Sends the prompt and audio to Gemini and returns the response text, or parse_response(text) if given.
+    If this audio was already processed with the same prompt, the cached text is used instead
+    and load_audio_part is never called, so the audio is never uploaded.
+    A response is only cached once it is complete and parse_response has accepted it, so a
+    truncated or malformed response raises without being cached and a retry calls Gemini again.
+    If the same request is already in flight, waits for and returns its result.
+    """
+    def parse(text):
+        return parse_response(text) if parse_response is not None else text
+
+    cache_key = (prompt_key, audio_hash)
+    with _response_cache_lock:
+        cached_text = _response_cache.get(cache_key)
+        if cached_text is not None:
+            return parse(cached_text)
+        pending = _pending_responses.get(cache_key)
+        is_owner = pending is None
+        if is_owner:
+            pending = _pending_responses[cache_key] = Future()
+
+    if not is_owner:
+        return parse(pending.result())
+
+    try:
+        # Another process may already have generated this response
+        response_text = get_cached_response(prompt_key, audio_hash)
+        if response_text is not None:
+            parsed_response = parse(response_text)
+        else:
+            # Send both the text prompt and the audio to Gemini
+            response = MODEL.generate_content([prompt_text, load_audio_part()], generation_config=generation_config)
+            response_text = response.text
+            finish_reason = response.candidates[0].finish_reason if response.candidates else None
+            check_response_complete(finish_reason, response_text)
+            parsed_response = parse(response_text)
+            cache_response(prompt_key, audio_hash, response_text)
+        pending.set_result(response_text)
+        return parsed_response
+    except BaseException as e:
+        # Waiting requests get the same error rather than hanging
+        pending.set_exception(e)
+        raise
+    finally:
+        with _response_cache_lock:
+            del _pending_responses[cache_key]
+
+def stream_cached(prompt_key, prompt_text, load_audio_part, audio_hash):
+    """
+    Yields Gemini's response text for the prompt and audio piece by piece, as it is generated.
+    A cached response is yielded in one piece; a complete, non-empty streamed response is cached
+    for later requests. Raises RuntimeError if the stream ends early or without any text.
+    """
+    cached_text = get_cached_response(prompt_key, audio_hash)
+    if cached_text is not None:
+        yield cached_text
+        return
+
+    response = MODEL.generate_content([prompt_text, load_audio_part()], stream=True)
+    text_chunks = []
+    finish_reason = None
+    for chunk in response:
+        if chunk.candidates and chunk.candidates[0].finish_reason:
+            finish_reason = chunk.candidates[0].finish_reason
+        if not chunk.parts: # e.g. a final chunk that only carries the finish reason
+            continue
+        text_chunks.append(chunk.text)
+        yield chunk.text
+
+    # Only a complete response is cached; one cut short (e.g. by SAFETY or RECITATION) is an error
+    response_text = "".join(text_chunks)
+    check_response_complete(finish_reason, response_text)
+    cache_response(prompt_key, audio_hash, response_text)
+
+def format_sse(data, event=None):
+    """Formats one Server-Sent Event. The data is sent as JSON so newlines in the text survive."""
+    message = f"data: {orjson.dumps(data).decode()}\n\n"
+    if event:
+        message = f"event: {event}\n{message}"
+    return message
+
+# --- Request Preprocessing ---
+
+# Endpoints that receive an uploaded audio file, and the subset that sends it to Gemini
+AUDIO_ENDPOINTS = {
+    'upload_audio', 'generate_notes', 'generate_notes_stream', 'generate_flashcards', 'generate_quizzes',
+    'generate_all', 'create_job',
+}
+GENERATION_ENDPOINTS = {
+    'generate_notes', 'generate_notes_stream', 'generate_flashcards', 'generate_quizzes',
+    'generate_all', 'create_job',
+}
+
+@app.before_request
+def reject_oversized_request():
+    """
+    Rejects requests whose declared Content-Length is over the upload limit,
+    before anything starts reading (and spooling) the request body.
+    """
+    if request.content_length is not None and request.content_length > app.config['MAX_CONTENT_LENGTH']:
+        abort(413)
+    return None
+
+@app.before_request
+def prepare_audio_upload():
+    """
+    Validates the uploaded audio once per request, before any handler runs.
+    For generation endpoints it also spools and hashes the upload, storing the
+    results on flask.g (audio_ext, audio_mime, audio_spool, audio_hash, load_audio_part)
+    for the handler to reuse.
+    """
+    # CORS preflight (OPTIONS) requests carry no body and must pass through
+    if request.method != 'POST' or request.endpoint not in AUDIO_ENDPOINTS:
+        return None
 
-@app.route('/upload_audio', methods=['POST'])
-def upload_audio():
     if 'audio' not in request.files:
         return jsonify({"error": "No audio file provided"}), 400
 
     audio_file = request.files['audio']
-    filename = audio_file.filename
+    if not audio_file.filename:
+        return jsonify({"error": "No file uploaded."}), 400
 
-    is_valid, error_msg = validate_audio_file(audio_file.stream, filename)
+    # Parse the extension once; validation and the MIME type both use it
+    g.audio_ext = get_file_extension(audio_file.filename)
+
+    is_valid, error_msg = validate_audio_file(audio_file.stream, g.audio_ext)
     if not is_valid:
         return jsonify({"error": error_msg}), 400
 
-    # At this point, the file is validated and its stream is rewound.
+    if request.endpoint in GENERATION_ENDPOINTS:
+        g.audio_mime = MIME_MAP[g.audio_ext]
+        g.audio_spool = spool_upload(audio_file.stream)
+        g.audio_hash = hash_file_chunked(g.audio_spool)
+        g.load_audio_part = make_audio_part_loader(g.audio_spool, g.audio_mime, g.audio_hash)
+    return None
+
+@app.teardown_request
+def close_audio_upload(exc):
+    """Releases the spooled upload (and any temp file behind it) at the end of the request."""
+    audio_spool = g.pop('audio_spool', None)
+    if audio_spool is not None:
+        audio_spool.close()
+
+# --- Response Schemas ---
+# Flashcards and quizzes use Gemini's JSON mode with a response schema, so the
+# response text is always valid JSON in the expected shape.
+
+class Flashcard(BaseModel):
+    front: str
+    back: str
+
+class QuizOptions(BaseModel):
+    A: str
+    B: str
+    C: str
+    D: str
+
+class QuizQuestion(BaseModel):
+    question: str
+    options: QuizOptions
+    correct_answer: str
+
+FLASHCARDS_GENERATION_CONFIG = genai.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=list[Flashcard],
+)
+QUIZ_GENERATION_CONFIG = genai.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=list[QuizQuestion],
+)
+
+# --- Prompts ---
+
+# Prompt for notes
+NOTES_PROMPT = """
+    You are an AI assistant specialized in creating detailed study notes from class recordings.
+    Please transcribe the following audio. After transcription, generate comprehensive notes with the following structure:
+    1.  **High-Level Overview:** A concise summary of the main topics covered in the class, briefly mentioning key concepts.
+    2.  **Concept-Wise Breakdown:** For each major concept discussed, provide a more detailed explanation, including definitions, relevant examples, and any formulas mentioned. Organize this clearly under concept headings.
+    3.  **Bullet Point Summary:** A concise list of the most important takeaways and key points, suitable for quick review.
+
+    Example of desired output structure:
+    ---
+    [High-Level Overview]
+    Class covered the newton's laws of motion. 1st law: ... 2nd law: ... 3rd law: ...
+    
+    [Concept-Wise Breakdown]
+    **Newton's First Law of Motion (Law of Inertia)**
+    Definition: ...
+    Explanation: ...
+    Example: ...
+    Formula/Principle: ...
+
+    **Newton's Second Law of Motion**
+    Definition: ...
+    Explanation: ...
+    Example: ...
+    Formula: F = ma (where F is force, m is mass, a is acceleration)
+    
+    **Newton's Third Law of Motion**
+    Definition: ...
+    Explanation: ...
+    Example: ...
+    Principle: ...
+    
+    [Bullet Point Summary]
+    - Newton's Laws of Motion:
+    - 1st Law: definition, example, principle of inertia.
+    - 2nd Law: definition, example, F=ma.
+    - 3rd Law: definition, example, action-reaction pairs.
+    ---
+    Ensure all output is in English, even if the speaker has an accent.
+    """
+# Note: The actual prompt should be more detailed, like the example I gave earlier.
+# This is a concise version for initial testing.
+
+# Prompt for flashcards
+FLASHCARDS_PROMPT = """
+    You are an AI assistant specialized in creating study flashcards from class content.
+    Please transcribe the following audio. From the transcribed content, identify 1 to 3 key concepts and/or formulas suitable for flashcards. For each flashcard, provide:
+    -   **Front:** The concept or formula itself.
+    -   **Back:** A clear, concise explanation or definition of the concept/formula.
+    Focus on a mix of important concepts and formulas.
+    
+    Provide the output in a structured JSON format, where each object represents a flashcard:
+    [
+        {
+            "front": "Concept/Formula Name",
+            "back": "Explanation/Definition"
+        },
+        {
+            "front": "Concept/Formula Name 2",
+            "back": "Explanation/Definition 2"
+        }
+    ]
+    """
+
+# Prompt for quizzes
+QUIZ_PROMPT = """
+    You are an AI assistant specialized in generating multiple-choice quiz questions from class content.
+    Please transcribe the following audio. From the transcribed content, create exactly 3 multiple-choice questions (MCQs) for general understanding. For each question:
+    -   Provide the question itself.
+    -   Provide 4 possible answer choices (A, B, C, D), where only one is correct.
+    -   Clearly indicate the correct answer.
+
+    Example of desired output structure (JSON format):
+    [
+        {
+            "question": "What is the primary definition of Newton's First Law of Motion?",
+            "options": {
+                "A": "Force equals mass times acceleration.",
+                "B": "For every action, there is an equal and opposite reaction.",
+                "C": "An object at rest stays at rest, and an object in motion stays in motion with the same speed and in the same direction unless acted upon by an unbalanced force.",
+                "D": "Energy cannot be created or destroyed."
+            },
+            "correct_answer": "C"
+        }
+    ]
+    Ensure the questions are at a general understanding difficulty level.
+    """
+
+# Response cache keys, versioned by the prompt text and generation config
+NOTES_CACHE_KEY = prompt_cache_key("notes", NOTES_PROMPT)
+FLASHCARDS_CACHE_KEY = prompt_cache_key("flashcards", FLASHCARDS_PROMPT, FLASHCARDS_GENERATION_CONFIG)
+QUIZ_CACHE_KEY = prompt_cache_key("quizzes", QUIZ_PROMPT, QUIZ_GENERATION_CONFIG)
+
+# --- Content Generation ---
+# Each function returns the generated content for one kind of study aid.
+# They are shared by the individual endpoints and /generate_all.
+
+def generate_notes_content(load_audio_part, audio_hash):
+    """Generates structured study notes (markdown text) from the lecture audio."""
+    return generate_cached(NOTES_CACHE_KEY, NOTES_PROMPT, load_audio_part, audio_hash)
+
+def generate_flashcards_content(load_audio_part, audio_hash):
+    """Generates flashcards from the lecture audio, as a list of {front, back} dicts."""
+    return generate_cached(
+        FLASHCARDS_CACHE_KEY, FLASHCARDS_PROMPT, load_audio_part, audio_hash,
+        generation_config=FLASHCARDS_GENERATION_CONFIG, parse_response=orjson.loads,
+    )
+
+def generate_quiz_content(load_audio_part, audio_hash):
+    """Generates multiple-choice questions from the lecture audio, as a list of dicts."""
+    return generate_cached(
+        QUIZ_CACHE_KEY, QUIZ_PROMPT, load_audio_part, audio_hash,
+        generation_config=QUIZ_GENERATION_CONFIG, parse_response=orjson.loads,
+    )
+
+# Generation function, response key and response cache key for each kind of background job
+JOB_KINDS = {
+    "notes": (generate_notes_content, "notes", NOTES_CACHE_KEY),
+    "flashcards": (generate_flashcards_content, "flashcards", FLASHCARDS_CACHE_KEY),
+    "quizzes": (generate_quiz_content, "quiz", QUIZ_CACHE_KEY),
+}
+
+# How long a queued job may run, and how long its result is kept for polling (seconds)
+JOB_TIMEOUT = 300
+JOB_RESULT_TTL = 3600
+
+# --- API Endpoints ---
+
+@app.errorhandler(413)
+def request_too_large(e):
+    max_size_mb = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    return jsonify({"error": f"Uploaded file is too large. Maximum upload size is {max_size_mb} MB."}), 413
+
+@app.route('/upload_audio', methods=['POST'])
+def upload_audio():
+    audio_file = request.files['audio']
+    filename = audio_file.filename
+
+    # At this point, the file has been validated by prepare_audio_upload and its stream is rewound.
     # You can now read audio_file.stream.read() to get the bytes
     # or pass audio_file.stream directly to Gemini.
 
@@ -85,77 +692,9 @@ def upload_audio():
 def generate_notes():
     # This route will receive the audio data (or a reference to it)
     # and call the Gemini API for notes.
-    # For now, it's a placeholder.
-    # The actual audio data would be sent here from the frontend,
-    # or if we store it temporarily, we'd reference it.
-    if 'audio' not in request.files:
-        return jsonify({"error": "No audio file provided"}), 400
-
-    audio_file = request.files['audio']
-    filename = audio_file.filename
-
-    is_valid, error_msg = validate_audio_file(audio_file.stream, filename)
-    if not is_valid:
-        return jsonify({"error": error_msg}), 400
-
+    # The audio has already been validated, spooled and hashed by prepare_audio_upload
     try:
-        model = get_gemini_model()
-        audio_content_bytes = audio_file.stream.read() # Read the content after validation
-
-        # Prepare the audio part for Gemini
-        audio_part = {
-            "mime_type": f"audio/{filename.rsplit('.', 1)[1].lower()}",
-            "data": audio_content_bytes
-        }
-
-        # Define the prompt for notes
-        prompt_text = """
-        You are an AI assistant specialized in creating detailed study notes from class recordings.
-        Please transcribe the following audio. After transcription, generate comprehensive notes with the following structure:
-        1.  **High-Level Overview:** A concise summary of the main topics covered in the class, briefly mentioning key concepts.
-        2.  **Concept-Wise Breakdown:** For each major concept discussed, provide a more detailed explanation, including definitions, relevant examples, and any formulas mentioned. Organize this clearly under concept headings.
-        3.  **Bullet Point Summary:** A concise list of the most important takeaways and key points, suitable for quick review.
-
-        Example of desired output structure:
-        ---
-        [High-Level Overview]
-        Class covered the newton's laws of motion. 1st law: ... 2nd law: ... 3rd law: ...
-        
-        [Concept-Wise Breakdown]
-        **Newton's First Law of Motion (Law of Inertia)**
-        Definition: ...
-        Explanation: ...
-        Example: ...
-        Formula/Principle: ...
-
-        **Newton's Second Law of Motion**
-        Definition: ...
-        Explanation: ...
-        Example: ...
-        Formula: F = ma (where F is force, m is mass, a is acceleration)
-        
-        **Newton's Third Law of Motion**
-        Definition: ...
-        Explanation: ...
-        Example: ...
-        Principle: ...
-        
-        [Bullet Point Summary]
-        - Newton's Laws of Motion:
-        - 1st Law: definition, example, principle of inertia.
-        - 2nd Law: definition, example, F=ma.
-        - 3rd Law: definition, example, action-reaction pairs.
-        ---
-        Ensure all output is in English, even if the speaker has an accent.
-        """
-        # Note: The actual prompt should be more detailed, like the example I gave earlier.
-        # This is a concise version for initial testing.
-
-        # Send both text prompt and audio to Gemini Pro Vision
-        response = model.generate_content([prompt_text, audio_part])
-
-        # Extract the text response
-        notes_content = response.text
+        notes_content = generate_notes_content(g.load_audio_part, g.audio_hash)
 
         return jsonify({"notes": notes_content}), 200
 
@@ -166,64 +705,44 @@ def generate_notes():
         return jsonify({"error": f"Failed to generate notes: {str(e)}"}), 500
 
 
-@app.route('/generate_flashcards', methods=['POST'])
-def generate_flashcards():
-    if 'audio' not in request.files:
-        return jsonify({"error": "No audio file provided"}), 400
-
-    audio_file = request.files['audio']
-    filename = audio_file.filename
+@app.route('/generate_notes_stream', methods=['POST'])
+def generate_notes_stream():
+    # Streams the notes as Server-Sent Events while Gemini generates them, so the first
+    # text reaches the client after the model's first-token latency instead of the whole generation.
+    # Events: text chunks as {"text": ...}, then "done", or "error" with {"error": ...}.
+    # The stream outlives the request's teardown, so it takes over closing the spooled upload
+    audio_spool = g.pop('audio_spool')
+    load_audio_part = g.load_audio_part
+    audio_hash = g.audio_hash
+
+    def events():
+        try:
+            for text in stream_cached(NOTES_CACHE_KEY, NOTES_PROMPT, load_audio_part, audio_hash):
+                yield format_sse({"text": text})
+            yield format_sse({}, event="done")
+        except genai.types.BlockedPromptException as e:
+            yield format_sse({"error": f"Content generation blocked due to safety policy: {e.response.prompt_feedback}"}, event="error")
+        except Exception as e:
+            yield format_sse({"error": f"Failed to generate notes: {str(e)}"}, event="error")
+        finally:
+            audio_spool.close()
+
+    return Response(
+        events(),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    is_valid, error_msg = validate_audio_file(audio_file.stream, filename)
-    if not is_valid:
-        return jsonify({"error": error_msg}), 400
 
+@app.route('/generate_flashcards', methods=['POST'])
+def generate_flashcards():
+    # The audio has already been validated, spooled and hashed by prepare_audio_upload
     try:
-        model = get_gemini_model()
-        audio_content_bytes = audio_file.stream.read()
-
-        audio_part = {
-            "mime_type": f"audio/{filename.rsplit('.', 1)[1].lower()}",
-            "data": audio_content_bytes
-        }
-
-        # Define the prompt for flashcards
-        prompt_text = """
-        You are an AI assistant specialized in creating study flashcards from class content.
-        Please transcribe the following audio. From the transcribed content, identify 1 to 3 key concepts and/or formulas suitable for flashcards. For each flashcard, provide:
-        -   **Front:** The concept or formula itself.
-        -   **Back:** A clear, concise explanation or definition of the concept/formula.
-        Focus on a mix of important concepts and formulas.
-        
-        Provide the output in a structured JSON format, where each object represents a flashcard:
-        [
-            {
-                "front": "Concept/Formula Name",
-                "back": "Explanation/Definition"
-            },
-            {
-                "front": "Concept/Formula Name 2",
-                "back": "Explanation/Definition 2"
-            }
-        ]
-        """
-
-        response = model.generate_content([prompt_text, audio_part])
-        flashcards_json_string = response.text
-
-        # Gemini might sometimes include markdown code block syntax (```json)
-        # We need to strip it to get pure JSON
-        if flashcards_json_string.strip().startswith('```json'):
-            flashcards_json_string = flashcards_json_string.strip()[len('```json'):]
-            if flashcards_json_string.strip().endswith('```'):
-                flashcards_json_string = flashcards_json_string.strip()[:-len('```')]
-
-        import json
-        flashcards_data = json.loads(flashcards_json_string)
+        flashcards_data = generate_flashcards_content(g.load_audio_part, g.audio_hash)
 
         return jsonify({"flashcards": flashcards_data}), 200
 
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         return jsonify({"error": "Gemini returned invalid JSON for flashcards. Please try again."}), 500
     except genai.types.BlockedPromptException as e:
         return jsonify({"error": f"Content generation blocked due to safety policy: {e.response.prompt_feedback}"}), 400
@@ -233,64 +752,13 @@ def generate_flashcards():
 
 @app.route('/generate_quizzes', methods=['POST'])
 def generate_quizzes():
-    if 'audio' not in request.files:
-        return jsonify({"error": "No audio file provided"}), 400
-
-    audio_file = request.files['audio']
-    filename = audio_file.filename
-
-    is_valid, error_msg = validate_audio_file(audio_file.stream, filename)
-    if not is_valid:
-        return jsonify({"error": error_msg}), 400
-
+    # The audio has already been validated, spooled and hashed by prepare_audio_upload
     try:
-        model = get_gemini_model()
-        audio_content_bytes = audio_file.stream.read()
-
-        audio_part = {
-            "mime_type": f"audio/{filename.rsplit('.', 1)[1].lower()}",
-            "data": audio_content_bytes
-        }
-
-        # Define the prompt for quizzes
-        prompt_text = """
-        You are an AI assistant specialized in generating multiple-choice quiz questions from class content.
-        Please transcribe the following audio. From the transcribed content, create exactly 3 multiple-choice questions (MCQs) for general understanding. For each question:
-        -   Provide the question itself.
-        -   Provide 4 possible answer choices (A, B, C, D), where only one is correct.
-        -   Clearly indicate the correct answer.
-
-        Example of desired output structure (JSON format):
-        [
-            {
-                "question": "What is the primary definition of Newton's First Law of Motion?",
-                "options": {
-                    "A": "Force equals mass times acceleration.",
-                    "B": "For every action, there is an equal and opposite reaction.",
-                    "C": "An object at rest stays at rest, and an object in motion stays in motion with the same speed and in the same direction unless acted upon by an unbalanced force.",
-                    "D": "Energy cannot be created or destroyed."
-                },
-                "correct_answer": "C"
-            }
-        ]
-        Ensure the questions are at a general understanding difficulty level.
-        """
-
-        response = model.generate_content([prompt_text, audio_part])
-        quiz_json_string = response.text
-
-        # Strip markdown code block syntax if present
-        if quiz_json_string.strip().startswith('```json'):
-            quiz_json_string = quiz_json_string.strip()[len('```json'):]
-            if quiz_json_string.strip().endswith('```'):
-                quiz_json_string = quiz_json_string.strip()[:-len('```')]
-
-        import json
-        quiz_data = json.loads(quiz_json_string)
+        quiz_data = generate_quiz_content(g.load_audio_part, g.audio_hash)
 
         return jsonify({"quiz": quiz_data}), 200
 
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         return jsonify({"error": "Gemini returned invalid JSON for quizzes. Please try again."}), 500
     except genai.types.BlockedPromptException as e:
         return jsonify({"error": f"Content generation blocked due to safety policy: {e.response.prompt_feedback}"}), 400
@@ -298,8 +766,92 @@ def generate_quizzes():
         return jsonify({"error": f"Failed to generate quizzes: {str(e)}"}), 500
 
 
+@app.route('/generate_all', methods=['POST'])
+async def generate_all():
+    # Notes, flashcards and quiz only depend on the same audio, so the three Gemini
+    # calls run concurrently and the total latency is roughly that of the slowest one.
+    try:
+        # Wait for all three threads, even if one fails, so none is still reading the
+        # upload when it is closed at the end of the request
+        results = await asyncio.gather(
+            asyncio.to_thread(generate_notes_content, g.load_audio_part, g.audio_hash),
+            asyncio.to_thread(generate_flashcards_content, g.load_audio_part, g.audio_hash),
+            asyncio.to_thread(generate_quiz_content, g.load_audio_part, g.audio_hash),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        notes_content, flashcards_data, quiz_data = results
+
+        return jsonify({
+            "notes": notes_content,
+            "flashcards": flashcards_data,
+            "quiz": quiz_data,
+        }), 200
+
+    except orjson.JSONDecodeError:
+        return jsonify({"error": "Gemini returned invalid JSON. Please try again."}), 500
+    except genai.types.BlockedPromptException as e:
+        return jsonify({"error": f"Content generation blocked due to safety policy: {e.response.prompt_feedback}"}), 400
+    except Exception as e:
+        return jsonify({"error": f"Failed to generate study materials: {str(e)}"}), 500
+
+
+@app.route('/jobs/<kind>', methods=['POST'])
+def create_job(kind):
+    # Queues a background generation job and returns its ID (202) once the audio is uploaded
+    # to Gemini; the upload itself still happens within this request. The client polls
+    # GET /jobs/<job_id> for the result. If the response is already cached, it is returned
+    # directly (200) in the same shape as the /generate_* endpoints.
+    if kind not in JOB_KINDS:
+        return jsonify({"error": f"Unknown job kind: {kind}. Expected one of: {', '.join(JOB_KINDS)}."}), 404
+
+    try:
+        # A cached response is returned straight away, without uploading the audio or queueing a job
+        generate_content, response_key, cache_key = JOB_KINDS[kind]
+        if get_cached_response(cache_key, g.audio_hash) is not None:
+            return jsonify({response_key: generate_content(g.load_audio_part, g.audio_hash)}), 200
+
+        # Fail fast if the job can't be queued, rather than uploading the audio for nothing
+        redis_connection.ping()
+
+        # Upload the audio here (whatever its size), so the worker only needs the Gemini file name
+        uploaded_file = get_gemini_file(g.audio_spool, g.audio_mime, g.audio_hash)
+        job = generation_queue.enqueue(
+            'tasks.run_generation', kind, uploaded_file.name, g.audio_hash,
+            job_timeout=JOB_TIMEOUT, result_ttl=JOB_RESULT_TTL,
+        )
+
+        return jsonify({"job_id": job.id}), 202
+
+    except RedisError as e:
+        return jsonify({"error": f"Could not queue the job: {str(e)}"}), 503
+    except Exception as e:
+        return jsonify({"error": f"Failed to start {kind} generation: {str(e)}"}), 500
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    try:
+        job = Job.fetch(job_id, connection=redis_connection)
+        status = job.get_status()
+    except NoSuchJobError:
+        return jsonify({"error": "Job not found. It may have expired."}), 404
+    except RedisError as e:
+        return jsonify({"error": f"Could not fetch the job: {str(e)}"}), 503
+
+    if status == JobStatus.FINISHED:
+        return jsonify({"status": status.value, **job.return_value()}), 200
+    if status in (JobStatus.FAILED, JobStatus.STOPPED, JobStatus.CANCELED):
+        kind = job.args[0]
+        return jsonify({"status": status.value, "error": f"Failed to generate {kind}. Please try again."}), 500
+    # Still queued or running
+    return jsonify({"status": status.value}), 200
+
+
 # --- Run the Flask App ---
 if __name__ == '__main__':
-    # For development, Flask defaults to port 5000.
-    # debug=True allows for auto-reloading on code changes.
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    # For local development only; Flask defaults to port 5000.
+    # In production, serve the app with gunicorn through wsgi.py (settings in gunicorn.conf.py).
+    app.run(debug=False, port=5000)
\ No newline at end of file
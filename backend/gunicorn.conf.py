@@ -0,0 +1,13 @@
+import multiprocessing
+
+# Gunicorn settings, loaded automatically when gunicorn is started from the backend directory.
+# Generation requests hold a thread for the whole Gemini round-trip, so each worker
+# process runs many threads to keep serving other requests while they wait.
+
+bind = "127.0.0.1:5000" # Same address the frontend expects from `flask run`
+workers = multiprocessing.cpu_count()
+worker_class = "gthread"
+threads = 32
+
+# Import the app (and configure Gemini) once in the master process; workers share it after fork
+preload_app = True
@@ -0,0 +1,17 @@
+import google.generativeai as genai
+from app import JOB_KINDS
+
+# Background generation jobs, queued by the /jobs endpoints in app.py.
+# Run the worker from the backend directory with:
+#   rq worker generation --worker-class rq.worker.SimpleWorker
+# SimpleWorker runs jobs in the worker process itself (no fork per job), so the
+# module-level MODEL and the response/file caches in app.py persist across jobs.
+
+def run_generation(kind, file_name, audio_hash):
+    """
+    Generates one kind of study aid for audio that was already uploaded to the Gemini File API.
+    Returns the result in the same shape as the matching /generate_* endpoint response.
+    """
+    generate_content, response_key, _ = JOB_KINDS[kind]
+    # The file is only looked up if the response isn't cached
+    return {response_key: generate_content(lambda: genai.get_file(file_name), audio_hash)}
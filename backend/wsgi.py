@@ -0,0 +1,6 @@
+from app import app
+
+# WSGI entry point for production servers. From the backend directory run:
+#   gunicorn wsgi:application
+# gunicorn picks up its settings from gunicorn.conf.py in the same directory.
+application = app
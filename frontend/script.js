@@ -1,6 +1,11 @@
 // --- Configuration ---
 const BACKEND_URL = 'http://127.0.0.1:5000'; // Our Flask backend URL
 const ESTIMATED_PROCESSING_TIME_SECONDS = 60 * 2; // Approx 2 minutes for a 15 min audio, adjust as needed
+// Run flashcard and quiz generation as background jobs. Needs Redis and an rq worker on the
+// backend (macOS/Linux only, see README); otherwise they are generated within the request.
+const USE_BACKGROUND_JOBS = false;
+const JOB_POLL_INTERVAL_MS = 2000; // How often to check on a background generation job
+const JOB_MAX_WAIT_MS = (5 + 2) * 60 * 1000; // Backend job timeout (5 min) plus time spent waiting in the queue
 
 // --- DOM Element Caching ---
 const dropArea = document.getElementById('drop-area');
@@ -134,9 +139,73 @@ function handleFile(file) {
     }
 }
 
+/**
+ * Polls a background generation job until it finishes.
+ * @param {string} jobId - The job ID returned by the backend.
+ * Gives up after JOB_MAX_WAIT_MS, e.g. when no worker is running to pick up the job.
+ * @returns {Promise<any>} The job's result, or null if the job failed or timed out.
+ */
+async function pollJob(jobId) {
+    const deadline = Date.now() + JOB_MAX_WAIT_MS;
+
+    while (Date.now() < deadline) {
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+
+        const response = await fetch(`${BACKEND_URL}/jobs/${jobId}`);
+        const data = await response.json();
+
+        if (!response.ok) {
+            showModal('Error', data.error || `An unknown error occurred: ${response.status}`);
+            return null;
+        }
+        if (data.status === 'finished') {
+            return data;
+        }
+    }
+
+    // Usually means no worker is running to pick up the queued job
+    showModal('Error', 'Generation is taking too long. Make sure the backend worker (rq worker) is running, then try again.');
+    return null;
+}
+
+/**
+ * Reads a Server-Sent Events stream from a fetch response until it ends.
+ * @param {Response} response - The streaming response from the backend.
+ * @param {function(string, any): void} onEvent - Called with each event's name and its parsed JSON data.
+ */
+async function readServerSentEvents(response, onEvent) {
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += value;
+
+        // Events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let eventName = 'message';
+            let data = '';
+            for (const line of rawEvent.split('\n')) {
+                if (line.startsWith('event: ')) {
+                    eventName = line.slice('event: '.length);
+                } else if (line.startsWith('data: ')) {
+                    data += line.slice('data: '.length);
+                }
+            }
+            onEvent(eventName, JSON.parse(data));
+        }
+    }
+}
+
 /**
  * Sends audio to the backend and fetches generated content.
- * @param {string} endpoint - The backend API endpoint (e.g., '/generate_notes').
+ * If the backend queues a background job (202), polls until the job finishes.
+ * @param {string} endpoint - The backend API endpoint (e.g., '/generate_flashcards' or '/jobs/flashcards').
  * @returns {Promise<any>} The parsed JSON response from the backend.
  */
 async function sendAudioToBackend(endpoint) {
@@ -163,6 +232,10 @@ async function sendAudioToBackend(endpoint) {
             return null;
         }
 
+        if (response.status === 202 && data.job_id) {
+            return await pollJob(data.job_id);
+        }
+
         return data;
     } catch (error) {
         console.error('Network or API Error:', error);
@@ -176,15 +249,47 @@ async function sendAudioToBackend(endpoint) {
 // --- Specific Content Generation Functions ---
 
 async function generateNotesAndSummary() {
-    const data = await sendAudioToBackend('/generate_notes');
-    if (data && data.notes) {
-        notesContentArea.value = data.notes;
-        notesOutput.classList.remove('hidden');
+    if (!uploadedAudioFile) {
+        showModal('Error', 'Please upload an audio file first.');
+        return;
+    }
+
+    showLoading('Generating notes...');
+    const formData = new FormData();
+    formData.append('audio', uploadedAudioFile);
+
+    try {
+        // Notes are streamed as Server-Sent Events and shown as they arrive
+        const response = await fetch(`${BACKEND_URL}/generate_notes_stream`, {
+            method: 'POST',
+            body: formData,
+        });
+
+        if (!response.ok) {
+            const data = await response.json();
+            showModal('Error', data.error || `An unknown error occurred: ${response.status}`);
+            return;
+        }
+
+        notesContentArea.value = '';
+        await readServerSentEvents(response, (event, data) => {
+            if (event === 'error') {
+                showModal('Error', data.error);
+            } else if (data.text) {
+                notesContentArea.value += data.text;
+                notesOutput.classList.remove('hidden');
+            }
+        });
+    } catch (error) {
+        console.error('Network or API Error:', error);
+        showModal('Network Error', `Could not connect to the backend or API: ${error.message}. Make sure the backend server is running.`);
+    } finally {
+        hideLoading();
     }
 }
 
 async function generateFlashcards() {
-    const data = await sendAudioToBackend('/generate_flashcards');
+    const data = await sendAudioToBackend(USE_BACKGROUND_JOBS ? '/jobs/flashcards' : '/generate_flashcards');
     if (data && data.flashcards) {
         flashcardsData = data.flashcards;
         if (flashcardsData.length > 0) {
@@ -198,7 +303,7 @@ async function generateFlashcards() {
 }
 
 async function generateQuizzes() {
-    const data = await sendAudioToBackend('/generate_quizzes');
+    const data = await sendAudioToBackend(USE_BACKGROUND_JOBS ? '/jobs/quizzes' : '/generate_quizzes');
     if (data && data.quiz) {
         quizData = data.quiz;
         if (quizData.length > 0) {